@@ -114,9 +114,14 @@ with st.sidebar:
                         prompt_type="universal",
                         prompt_universal=1,
                         targets=["bbox"],
-                        bbox_threshold=0.1
+                        bbox_threshold=0.1,
+                        use_cache=False
                     )
                 
+                # detect_objects 不会抛出异常，失败原因记录在 error 字段中
+                if "error" in result:
+                    raise Exception(result["error"]["message"])
+                
                 st.success("API 令牌有效！")
             except Exception as e:
                 st.error(f"API 令牌验证失败: {str(e)}")
@@ -343,6 +348,8 @@ with col1:
                         # Show success message
                         if "objects" in result and result["objects"]:
                             st.success(f"成功检测到 {len(result['objects'])} 个对象！")
+                        elif "error" in result:
+                            st.error(f"检测失败 ({result['error']['type']}): {result['error']['message']}")
                         else:
                             st.warning("未检测到任何对象。尝试调整提示词或降低置信度阈值。")
 
@@ -378,6 +385,8 @@ with col1:
                         # Show success message
                         if "objects" in result and result["objects"]:
                             st.success(f"成功检测到 {len(result['objects'])} 个对象！")
+                        elif "error" in result:
+                            st.error(f"检测失败 ({result['error']['type']}): {result['error']['message']}")
                         else:
                             st.error("通用检测也未能检测到任何对象。请检查图像质量或 API 连接。")
             
@@ -540,9 +549,13 @@ with col2:
                         prompt_type="universal",
                         prompt_universal=1,
                         targets=["bbox"],
-                        bbox_threshold=0.1
+                        bbox_threshold=0.1,
+                        use_cache=False
                     )
                 
+                if "error" in result:
+                    raise Exception(result["error"]["message"])
+                
                 st.success("API 连接成功!")
                 st.write("API 响应:", result)
             except Exception as e:
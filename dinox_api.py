@@ -1,62 +1,528 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import aiohttp
+from aiolimiter import AsyncLimiter
+import asyncio
 import base64
-import json
+import concurrent.futures
+import hashlib
+import logging
+import multiprocessing
+import threading
+from collections import OrderedDict, deque
+import orjson
+import msgspec
+from typing import Any, Optional
 import time
 import os
+import random
+import re
+from pathlib import Path
 from dotenv import load_dotenv
 from PIL import Image
 import io
 import numpy as np
 
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+# 可选的磁盘缓存，用于跨进程持久化 API 结果
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+# libjpeg-turbo（SIMD 加速）可用时直接编码 numpy 数组，否则回退到 PIL
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJSAMP_420
+    _TJ = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    _TJ = None
+
 # Load environment variables
 load_dotenv()
 
+# 调试信息通过 logging 输出；设置 DINOX_DEBUG=1 开启 DEBUG 级别日志
+log = logging.getLogger(__name__)
+if not log.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    log.addHandler(_handler)
+log.setLevel(logging.DEBUG if os.getenv("DINOX_DEBUG") == "1" else logging.INFO)
+
 # Get API token from environment variables or use a hardcoded value
 # 请将下面的 "你的API令牌" 替换为你从 DINO-X 获取的实际 API 令牌
 API_TOKEN = os.getenv("DINOX_API_TOKEN") or "你的API令牌"
 
+# 进程池的子进程（spawn/forkserver）也会导入本模块，只在主进程中打印状态和预热连接
+# 子进程导入主模块时 parent_process() 尚未设置，但进程名已经改为 SpawnProcess-N 等
+_IN_MAIN_PROCESS = (multiprocessing.parent_process() is None
+                    and multiprocessing.current_process().name == "MainProcess")
+
 # 打印API令牌状态（不显示完整令牌）
-if API_TOKEN and API_TOKEN != "你的API令牌":
-    print(f"API令牌已设置: {API_TOKEN[:5]}...{API_TOKEN[-5:]} (长度: {len(API_TOKEN)})")
-else:
-    print("警告: API令牌未设置或使用了默认值")
+if _IN_MAIN_PROCESS:
+    if API_TOKEN and API_TOKEN != "你的API令牌":
+        log.info("API令牌已设置: %s...%s (长度: %d)", API_TOKEN[:5], API_TOKEN[-5:], len(API_TOKEN))
+    else:
+        log.warning("API令牌未设置或使用了默认值")
 
 # API endpoints
 DETECTION_API_URL = "https://api.deepdataspace.com/v2/task/dinox/detection"
 REGION_VL_API_URL = "https://api.deepdataspace.com/v2/task/dinox/region_vl"
 TASK_STATUS_API_URL = "https://api.deepdataspace.com/v2/task_status/{task_uuid}"
+_TASK_URL_TMPL = TASK_STATUS_API_URL
+
+# 请求头只构建一次，由同步和异步会话共享
+_HEADERS = {
+    "Token": API_TOKEN,
+    "Content-Type": "application/json"
+}
+
+# 共享的 HTTP 会话：复用 keep-alive 连接池，避免每次请求（包括每次轮询）重新进行 TCP+TLS 握手
+# 只对幂等的 GET 请求在 502/503/504 时自动重试，POST 不会被重复提交
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+    pool_connections=32,
+    pool_maxsize=32
+))
+_SESSION.headers.update(_HEADERS)
+
+# 请求体中的阈值、区域坐标可能是 numpy 标量或数组，序列化时统一开启 numpy 支持
+_JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY
+
+# 提交任务的 (连接, 读取) 超时秒数，避免卡住的连接无限期阻塞调用方
+_POST_TIMEOUT = (5, 30)
+# 单次状态查询的最长读取时间，实际取值不超过剩余的总超时时间
+_POLL_TIMEOUT = 10
+
+API_BASE_URL = "https://api.deepdataspace.com/"
+
+def _warmup_session():
+    """
+    Resolve DNS and complete the TLS handshake for the API host ahead of the first real request
+    在后台线程中执行，建立的连接留在 _SESSION 的连接池中供后续请求复用
+    """
+    try:
+        _SESSION.head(API_BASE_URL, timeout=5)
+        log.debug("API连接预热完成")
+    except Exception as e:
+        log.debug("API连接预热失败: %s", e)
+
+_WARMUP_LOCK = threading.Lock()
+_WARMUP_STARTED = False
+
+def _start_warmup():
+    """
+    Start warming up the API connection once, on the first API call
+    在编码图像之前调用，使握手与编码重叠；设置 DINOX_WARMUP=0 可关闭
+    """
+    global _WARMUP_STARTED
+    if _WARMUP_STARTED or not _IN_MAIN_PROCESS or os.getenv("DINOX_WARMUP") == "0":
+        return
+    with _WARMUP_LOCK:
+        if _WARMUP_STARTED:
+            return
+        _WARMUP_STARTED = True
+    threading.Thread(target=_warmup_session, name="dinox-warmup", daemon=True).start()
+
+# 上传图像的编码格式：默认 WEBP（体积更小），设置 DINOX_IMAGE_FORMAT=JPEG 可切换回 JPEG
+IMAGE_FORMAT = (os.getenv("DINOX_IMAGE_FORMAT") or "WEBP").upper()
+
+# 上传前将图像最长边限制在 MAX_EDGE 像素以内（服务端本身也会缩小大图）
+MAX_EDGE = 1536
 
 # 打印API端点
-print(f"检测API端点: {DETECTION_API_URL}")
-print(f"区域视觉语言API端点: {REGION_VL_API_URL}")
-print(f"任务状态API端点: {TASK_STATUS_API_URL}")
+log.debug("检测API端点: %s", DETECTION_API_URL)
+log.debug("区域视觉语言API端点: %s", REGION_VL_API_URL)
+log.debug("任务状态API端点: %s", TASK_STATUS_API_URL)
+
+class DinoxAPIError(Exception):
+    """DINO-X API 调用失败的基类"""
+
+class AuthError(DinoxAPIError, ValueError):
+    """API 令牌缺失或无效（HTTP 401/403）"""
+
+class MalformedResponseError(DinoxAPIError):
+    """API 返回了无法解析或缺少必要字段的响应"""
 
-def encode_image_to_base64(image):
+class TaskFailedError(DinoxAPIError):
+    """任务在服务端执行失败（终止状态，不应继续轮询）"""
+
+class TaskTimeoutError(DinoxAPIError):
+    """任务在超时时间内没有完成"""
+
+# API 响应结构：直接解码为带类型的 Struct，一次完成解析与校验，未声明的字段会被忽略
+# 只对客户端实际依赖的字段约束类型，msg、session_id 等原样透传的字段接受任意类型
+class SubmitData(msgspec.Struct):
+    task_uuid: Optional[str] = None
+    uuid: Optional[str] = None
+    estimated_completion_ms: Optional[float] = None
+    eta_ms: Optional[float] = None
+
+class SubmitResp(msgspec.Struct):
+    code: int
+    msg: Any = None
+    data: Optional[SubmitData] = None
+
+class StatusData(msgspec.Struct):
+    status: Optional[str] = None
+    result: Optional[dict] = None
+    objects: Optional[list] = None
+    session_id: Any = None
+    error: Any = None
+
+class StatusResp(msgspec.Struct):
+    code: int
+    msg: Any = None
+    data: Optional[StatusData] = None
+
+# 提交任务时遇到这些状态码会退避重试（限流或服务端暂时不可用）
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def _post_task(url, body, max_retries=3, base_delay=0.5, max_delay=8.0, jitter=0.5):
     """
-    Convert an image (numpy array or PIL Image) to base64 string
+    Submit a task synchronously, retrying 429/5xx responses with jittered exponential backoff
+    与 _submit_async 的重试策略相同；其他状态码（如 400/401/403）重试也不会成功，直接返回
     """
-    if isinstance(image, np.ndarray):
-        # Convert numpy array to PIL Image
-        image = Image.fromarray(image)
+    for attempt in range(max_retries + 1):
+        response = _SESSION.post(url, data=body, timeout=_POST_TIMEOUT)
+        
+        log.debug("Response status code: %s", response.status_code)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Response text: %.500s...", response.text)  # 只打印前500个字符
+        
+        if response.status_code not in _RETRY_STATUSES or attempt == max_retries:
+            return response
+        delay = min(max_delay, base_delay * 2 ** attempt) + random.uniform(0, jitter)
+        log.warning("Submit got status %s, retrying in %.2f seconds", response.status_code, delay)
+        time.sleep(delay)
+
+def _check_http_status(status_code, text):
+    """
+    Raise the matching DinoxAPIError for a non-200 HTTP status
+    """
+    if status_code in (401, 403):
+        raise AuthError(f"API request failed with status code {status_code}: {text}")
+    if status_code != 200:
+        raise DinoxAPIError(f"API request failed with status code {status_code}: {text}")
+
+def _error_info(e):
+    """
+    Describe an exception as a structured error so callers can tell failure kinds apart
+    """
+    if isinstance(e, AuthError):
+        error_type = "auth"
+    elif isinstance(e, TaskTimeoutError):
+        error_type = "timeout"
+    elif isinstance(e, MalformedResponseError):
+        error_type = "malformed"
+    elif isinstance(e, TaskFailedError):
+        error_type = "failed"
+    elif isinstance(e, (requests.RequestException, aiohttp.ClientError)):
+        error_type = "network"
+    elif isinstance(e, DinoxAPIError):
+        error_type = "api"
+    else:
+        error_type = "unknown"
+    return {"type": error_type, "message": str(e)}
+
+class _LRUCache:
+    """
+    Minimal thread-safe LRU cache backed by an OrderedDict
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
     
-    # Convert PIL Image to base64
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+    
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+# 在字节层面识别未完成的任务状态，非终止状态的轮询响应无需完整解析 JSON
+_PENDING_STATUS_RE = re.compile(rb'"status"\s*:\s*"(waiting|running)"')
+
+# 各端点任务耗时的指数滑动平均（秒），服务端未返回 ETA 时用于安排首次轮询
+_LATENCY_EWMA = {}
+_EWMA_ALPHA = 0.3
+
+# 编码结果缓存：图像内容哈希 -> data URL
+_ENC_CACHE = _LRUCache(maxsize=64)
+# 任务结果缓存：task_uuid -> (result, session_id)
+_TASK_RESULT_CACHE = _LRUCache(maxsize=256)
+# API 结果缓存：(图像哈希, 请求参数) -> (result, session_id)
+_RESULT_CACHE = _LRUCache(maxsize=512)
+# 设置了 DINOX_CACHE_DIR 且安装了 diskcache 时才启用磁盘缓存
+_DISK_CACHE = None
+if diskcache is not None and os.getenv("DINOX_CACHE_DIR"):
+    try:
+        _DISK_CACHE = diskcache.Cache(os.path.expanduser(os.getenv("DINOX_CACHE_DIR")))
+    except Exception as e:
+        log.warning("无法初始化磁盘缓存: %s", e)
+
+def _image_digest(image):
+    """
+    Hash the content of an image input into a 128-bit key
+    像素图像（numpy 数组、PIL Image）哈希原始像素；str、bytes、Path 哈希其内容
+    优先使用 BLAKE3，未安装时回退到 hashlib.blake2b
+    """
+    if isinstance(image, str):
+        header, raw = b"str", image.encode("utf-8")
+    elif isinstance(image, (bytes, bytearray)):
+        header, raw = b"bytes", image
+    elif isinstance(image, Path):
+        header, raw = b"bytes", image.read_bytes()
+    elif isinstance(image, np.ndarray):
+        # 形状和类型也参与哈希，避免相同字节、不同形状的数组冲突
+        header = f"{image.shape}|{image.dtype}".encode("ascii")
+        raw = np.ascontiguousarray(image).data
+    else:
+        header = f"{image.size}|{image.mode}".encode("ascii")
+        raw = image.tobytes()
+    
+    if blake3 is not None:
+        hasher = blake3.blake3(header)
+        hasher.update(raw)
+        return hasher.digest()[:16]
+    hasher = hashlib.blake2b(header, digest_size=16)
+    hasher.update(raw)
+    return hasher.digest()
+
+def _data_url(mime, buffer):
+    """
+    Build a base64 data URL from raw image bytes (any buffer-protocol object)
+    前缀以 bytes 形式拼接后只解码一次；base64 字母表是纯 ASCII，使用更快的 ascii 解码
+    """
+    return (b"data:" + mime + b";base64," + base64.b64encode(buffer)).decode("ascii")
+
+def _sniff_mime(data):
+    """
+    Guess the MIME type of encoded image bytes from their magic number
+    """
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return b"image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return b"image/webp"
+    return b"image/jpeg"
+
+def _is_pixel_image(image):
+    """
+    Whether the input holds decoded pixels (and may therefore be resized before upload)
+    """
+    return isinstance(image, (np.ndarray, Image.Image))
+
+def _to_data_url(image, digest=None):
+    """
+    Convert any supported image input to the string sent as the "image" field
+    - str：已是 data URL 或图像 URL，原样返回
+    - bytes / Path：已编码的图像文件，直接 base64，跳过解码再编码
+    - numpy 数组 / PIL Image：通过 encode_image_to_base64 编码
+    digest 为已计算好的 _image_digest(image)，传入时不再重复哈希
+    """
+    if isinstance(image, str):
+        return image
+    if isinstance(image, Path):
+        image = image.read_bytes()
+    if isinstance(image, (bytes, bytearray)):
+        return _data_url(_sniff_mime(image), image)
+    return encode_image_to_base64(image, digest=digest)
+
+def _upload_scale(image):
+    """
+    Return the factor the input is scaled by before upload; only pixel images are resized
+    """
+    return _image_scale(image) if _is_pixel_image(image) else 1.0
+
+def _to_pil(image):
+    """
+    Convert a numpy array to a PIL Image, sharing memory when possible
+    对连续的 uint8 RGB 数组使用 Image.frombuffer，避免 Image.fromarray 的整块拷贝
+    """
+    if not isinstance(image, np.ndarray):
+        return image
+    if image.dtype == np.uint8 and image.ndim == 3 and image.shape[2] == 3 and image.flags["C_CONTIGUOUS"]:
+        height, width = image.shape[:2]
+        return Image.frombuffer("RGB", (width, height), image, "raw", "RGB", 0, 1)
+    return Image.fromarray(image)
+
+def _result_cache_key(endpoint, digest, params):
+    """
+    Build a result cache key from the image digest (see _image_digest) and the request parameters
+    参数无法序列化时返回 None，表示不缓存
+    """
+    try:
+        params_bytes = orjson.dumps(params, option=orjson.OPT_SORT_KEYS | _JSON_OPTIONS)
+    except TypeError:
+        return None
+    return endpoint.encode("ascii") + b"|" + digest + b"|" + params_bytes
+
+def _result_cache_get(key):
+    """
+    Look up a cached API result, checking memory first and then disk
+    """
+    if key is None:
+        return None
+    cached = _RESULT_CACHE.get(key)
+    if cached is None and _DISK_CACHE is not None:
+        cached = _DISK_CACHE.get(key)
+        if cached is not None:
+            _RESULT_CACHE.put(key, cached)
+    return cached
+
+def _result_cache_put(key, value):
+    """
+    Store an API result in the memory cache and, if enabled, the disk cache
+    """
+    if key is None:
+        return
+    _RESULT_CACHE.put(key, value)
+    if _DISK_CACHE is not None:
+        _DISK_CACHE.set(key, value)
+
+def _encode_jpeg(image, quality=85):
+    """
+    Encode an image (numpy array or PIL Image) as a JPEG data URL
+    定义在模块顶层以便可被 pickle，供进程池并行编码使用
+    """
+    if _TJ is not None and isinstance(image, np.ndarray) and image.dtype == np.uint8 \
+            and image.ndim == 3 and image.shape[2] == 3:
+        # 直接把像素缓冲区交给 libjpeg-turbo，跳过 PIL 转换
+        jpeg_bytes = _TJ.encode(np.ascontiguousarray(image), quality=quality,
+                                pixel_format=TJPF_RGB, jpeg_subsample=TJSAMP_420)
+        return _data_url(b"image/jpeg", jpeg_bytes)
+    
+    image = _to_pil(image)
+    
+    # optimize=False、subsampling=2 (4:2:0) 以减少 libjpeg 的计算量
     buffered = io.BytesIO()
-    image.save(buffered, format="JPEG")
-    img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-    return f"data:image/jpeg;base64,{img_str}"
+    image.save(buffered, format="JPEG", quality=quality, optimize=False, subsampling=2)
+    # getbuffer() 直接暴露内部缓冲区，避免 getvalue() 的整块拷贝
+    return _data_url(b"image/jpeg", buffered.getbuffer())
 
-def detect_objects_async(image, prompt_type="text", prompt_text=None, prompt_universal=None, 
-                        targets=["bbox"], bbox_threshold=0.25, iou_threshold=0.8, session_id=None):
+def _encode_webp(image, quality=80, method=4):
     """
-    Create a detection task using the DINO-X API and return the task UUID
-    按照最新API文档创建检测任务
+    Encode an image (numpy array or PIL Image) as a WebP data URL
+    同等画质下体积比 JPEG 小约 25-35%，可显著减少上传的数据量
     """
-    if not API_TOKEN or API_TOKEN == "你的API令牌":
-        raise ValueError("API token not found or using default value. Please set the DINOX_API_TOKEN environment variable.")
+    image = _to_pil(image)
     
-    # 准备图像数据
-    image_data = image if isinstance(image, str) else encode_image_to_base64(image)
+    buffered = io.BytesIO()
+    image.save(buffered, format="WEBP", quality=quality, method=method)
+    return _data_url(b"image/webp", buffered.getbuffer())
+
+def _image_scale(image, max_edge=MAX_EDGE):
+    """
+    Return the factor an image is scaled by before upload (1.0 if it is not resized)
+    """
+    if isinstance(image, np.ndarray):
+        height, width = image.shape[:2]
+    else:
+        width, height = image.size
+    longest = max(width, height)
+    if not max_edge or longest <= max_edge:
+        return 1.0
+    return max_edge / longest
+
+def _downscale(image, max_edge=MAX_EDGE):
+    """
+    Shrink an image so that its longest edge is at most max_edge pixels
+    使用 BILINEAR 而非 LANCZOS：开销约为四分之一，对检测效果几乎没有影响
+    """
+    scale = _image_scale(image, max_edge)
+    if scale == 1.0:
+        return image
+    image = _to_pil(image)
+    # 极端长宽比的图像短边可能被缩成 0，至少保留 1 像素
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.BILINEAR)
+
+def _rescale_keypoints(keypoints, scale):
+    """
+    Map keypoint coordinates back to the original resolution
+    支持 visualization.draw_keypoints 接受的三种格式：扁平列表、嵌套列表、字典列表
+    """
+    if not isinstance(keypoints, list) or not keypoints:
+        return keypoints
+    first = keypoints[0]
+    if isinstance(first, list):
+        # 嵌套列表：[[x, y, v, s], ...]
+        return [[v / scale if i < 2 else v for i, v in enumerate(kp)] for kp in keypoints]
+    if isinstance(first, dict):
+        # 字典列表：[{"x": x, "y": y, "visible": v, "score": s}, ...]
+        return [dict(kp, **{k: kp[k] / scale for k in ("x", "y") if isinstance(kp.get(k), (int, float))})
+                for kp in keypoints]
+    if isinstance(first, (int, float)):
+        # 扁平格式：[x, y, v, s, x, y, v, s, ...]
+        return [v / scale if i % 4 < 2 else v for i, v in enumerate(keypoints)]
+    log.warning("Unsupported keypoints format, left unscaled: %s", type(first))
+    return keypoints
+
+def _rescale_result(result, scale):
+    """
+    Map bbox and keypoint coordinates of a result back to the original image resolution
+    返回新的结果字典，不修改原对象（原对象可能保存在任务结果缓存中）
+    """
+    if scale == 1.0 or not result or not result.get("objects"):
+        return result
+    
+    objects = []
+    for obj in result["objects"]:
+        obj = dict(obj)
+        if isinstance(obj.get("bbox"), list):
+            obj["bbox"] = [v / scale for v in obj["bbox"]]
+        for key in ["pose_keypoints", "hand_keypoints"]:
+            if key in obj:
+                obj[key] = _rescale_keypoints(obj[key], scale)
+        objects.append(obj)
+    return dict(result, objects=objects)
+
+def _encode_image(image, image_format=None, quality=None, max_edge=MAX_EDGE):
+    """
+    Encode an image in the configured upload format (WEBP or JPEG)
+    """
+    image = _downscale(image, max_edge)
+    image_format = (image_format or IMAGE_FORMAT).upper()
+    if image_format == "JPEG":
+        return _encode_jpeg(image, quality or 85)
+    if image_format == "WEBP":
+        return _encode_webp(image, quality or 80)
+    raise ValueError(f"Unsupported image format: {image_format}")
+
+def encode_image_to_base64(image, quality=None, image_format=None, max_edge=MAX_EDGE, digest=None):
+    """
+    Convert an image (numpy array or PIL Image) to base64 string
+    最长边超过 max_edge 的图像会先被缩小，缩放比例可通过 _image_scale 获得
+    相同内容的图像直接返回缓存的编码结果；调用方已计算过 _image_digest 时可通过 digest 传入
+    """
+    image_format = (image_format or IMAGE_FORMAT).upper()
+    key = (digest or _image_digest(image), image_format, quality, max_edge)
+    cached = _ENC_CACHE.get(key)
+    if cached is not None:
+        return cached
     
+    image_data = _encode_image(image, image_format, quality, max_edge)
+    _ENC_CACHE.put(key, image_data)
+    return image_data
+
+def _build_detection_payload(image_data, prompt_type="text", prompt_text=None, prompt_universal=None,
+                             targets=["bbox"], bbox_threshold=0.25, iou_threshold=0.8, session_id=None):
+    """
+    Build the JSON payload for a detection task from already-encoded image data
+    """
     # 准备提示结构
     prompt = {"type": prompt_type}
     if prompt_type == "text" and prompt_text:
@@ -64,7 +530,6 @@ def detect_objects_async(image, prompt_type="text", prompt_text=None, prompt_uni
     elif prompt_type == "universal" and prompt_universal:
         prompt["universal"] = prompt_universal
     
-    # 准备请求载荷
     payload = {
         "image": image_data,
         "targets": targets,
@@ -77,237 +542,320 @@ def detect_objects_async(image, prompt_type="text", prompt_text=None, prompt_uni
     if session_id:
         payload["session_id"] = session_id
     
-    # 准备请求头
-    headers = {
-        "Token": API_TOKEN,
-        "Content-Type": "application/json"
-    }
+    return payload
+
+def _parse_submit_response(raw):
+    """
+    Decode a task submission response body and return (task_uuid, eta_hint_ms)
+    eta_hint_ms 为服务端预计的完成时间（毫秒），响应中没有时为 None
+    """
+    try:
+        response = msgspec.json.decode(raw, type=SubmitResp)
+    except msgspec.DecodeError as e:
+        log.error("无法解析JSON响应: %s", raw)
+        raise MalformedResponseError(f"API返回了无效的JSON响应: {e}")
+    log.debug("Response data: %s", response)
+    
+    if response.code != 0:
+        raise DinoxAPIError(f"API request failed: {response.msg}")
+    
+    # 检查响应中是否包含task_uuid
+    if response.data is None:
+        raise MalformedResponseError(f"API response missing 'data' field: {response}")
+    
+    # 检查是否包含task_uuid或uuid（兼容不同的API版本）
+    data = response.data
+    task_uuid = data.task_uuid or data.uuid
+    if not task_uuid:
+        raise MalformedResponseError(f"API response missing task identifier in 'data': {data}")
+    
+    eta_hint_ms = data.estimated_completion_ms if data.estimated_completion_ms is not None else data.eta_ms
+    return task_uuid, eta_hint_ms
+
+def _task_result(data):
+    """
+    Build the (result, session_id) pair from the data of a successful status response
+    """
+    if data.result is None:
+        log.warning("API response missing 'result' field in 'data': %s", data)
+        # 尝试兼容不同的API版本
+        if data.objects is not None:
+            log.debug("Found 'objects' directly in data, using it as result")
+            return {"objects": data.objects}, data.session_id
+        return {}, data.session_id
+    return data.result, data.session_id
+
+def _first_poll_delay(endpoint, eta_hint_ms):
+    """
+    Seconds to wait after submission before the first status poll
+    优先使用服务端 ETA（提前 0.3 秒）；否则参考该端点历史耗时的一半
+    """
+    if eta_hint_ms is not None:
+        return max(0.0, eta_hint_ms / 1000 - 0.3)
+    latency = _LATENCY_EWMA.get(endpoint)
+    if latency is not None:
+        return latency * 0.5
+    return 0.0
+
+def _record_latency(endpoint, seconds):
+    """
+    Update the moving average of task latency for an endpoint
+    """
+    if endpoint is None:
+        return
+    previous = _LATENCY_EWMA.get(endpoint)
+    _LATENCY_EWMA[endpoint] = seconds if previous is None else previous + _EWMA_ALPHA * (seconds - previous)
+
+def detect_objects_async(image, prompt_type="text", prompt_text=None, prompt_universal=None, 
+                        targets=["bbox"], bbox_threshold=0.25, iou_threshold=0.8, session_id=None, digest=None):
+    """
+    Create a detection task using the DINO-X API and return (task_uuid, eta_hint_ms)
+    按照最新API文档创建检测任务；digest 为已计算好的图像哈希，用于复用编码缓存
+    """
+    if not API_TOKEN or API_TOKEN == "你的API令牌":
+        raise AuthError("API token not found or using default value. Please set the DINOX_API_TOKEN environment variable.")
+    
+    _start_warmup()
     
-    print(f"Sending request to {DETECTION_API_URL}")
-    print(f"Headers: {headers}")
-    print(f"Payload keys: {list(payload.keys())}")
+    # 准备图像数据
+    image_data = _to_data_url(image, digest)
+    
+    # 准备请求载荷
+    payload = _build_detection_payload(
+        image_data, prompt_type, prompt_text, prompt_universal,
+        targets, bbox_threshold, iou_threshold, session_id
+    )
+    
+    log.debug("Sending request to %s", DETECTION_API_URL)
+    log.debug("Payload keys: %s", list(payload.keys()))
+    
+    # 载荷只序列化一次，重试时复用同一份请求体
+    body = orjson.dumps(payload, option=_JSON_OPTIONS)
     
-    # 尝试多种API调用方式
     try:
-        print("尝试方式1: 使用requests.post的json参数")
-        response = requests.post(DETECTION_API_URL, json=payload, headers=headers)
-        
-        print(f"Response status code: {response.status_code}")
-        print(f"Response text: {response.text[:500]}...")  # 只打印前500个字符
-        
-        if response.status_code != 200:
-            print("尝试方式2: 使用requests.post的data参数和手动JSON序列化")
-            json_payload = json.dumps(payload)
-            response = requests.post(DETECTION_API_URL, data=json_payload, headers=headers)
-            
-            print(f"Response status code: {response.status_code}")
-            print(f"Response text: {response.text[:500]}...")  # 只打印前500个字符
-            
-            if response.status_code != 200:
-                print("尝试方式3: 按照官方文档示例使用json.dumps")
-                headers["Content-Type"] = "application/json"
-                response = requests.post(
-                    url=DETECTION_API_URL,
-                    data=json.dumps(payload),
-                    headers=headers
-                )
-                
-                print(f"Response status code: {response.status_code}")
-                print(f"Response text: {response.text[:500]}...")  # 只打印前500个字符
+        response = _post_task(DETECTION_API_URL, body)
     except Exception as e:
-        print(f"API request error: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
+        log.error("API request error: %s", e)
         raise
     
+    # 只在出错时才把响应体解码为文本
     if response.status_code != 200:
-        raise Exception(f"API request failed with status code {response.status_code}: {response.text}")
+        _check_http_status(response.status_code, response.text)
     
-    try:
-        response_data = response.json()
-        print(f"Response data: {json.dumps(response_data)}")
-        
-        if response_data.get("code") != 0:
-            raise Exception(f"API request failed: {response_data.get('msg')}")
-        
-        # 检查响应中是否包含task_uuid
-        if 'data' not in response_data:
-            raise Exception(f"API response missing 'data' field: {response_data}")
-        
-        # 检查是否包含task_uuid或uuid（兼容不同的API版本）
-        if 'task_uuid' in response_data['data']:
-            return response_data["data"]["task_uuid"]
-        elif 'uuid' in response_data['data']:
-            return response_data["data"]["uuid"]
-        else:
-            raise Exception(f"API response missing task identifier in 'data': {response_data['data']}")
-    except json.JSONDecodeError:
-        print(f"无法解析JSON响应: {response.text}")
-        raise Exception("API返回了无效的JSON响应")
+    return _parse_submit_response(response.content)
 
-def get_task_result(task_uuid, max_retries=30, retry_interval=1):
+def get_task_result(task_uuid, total_timeout=60, initial_delay=0.2, max_delay=3.0, backoff=1.5,
+                    eta_hint_ms=None, endpoint=None):
     """
     Get the result of a task using the DINO-X API
     按照最新API文档获取任务结果
+
+    首次轮询前先按 eta_hint_ms（或 endpoint 的历史耗时）等待，之后轮询间隔从 initial_delay
+    开始按 backoff 倍数递增，最大不超过 max_delay，总等待时间不超过 total_timeout 秒
     """
     if not API_TOKEN or API_TOKEN == "你的API令牌":
-        raise ValueError("API token not found or using default value. Please set the DINOX_API_TOKEN environment variable.")
+        raise AuthError("API token not found or using default value. Please set the DINOX_API_TOKEN environment variable.")
     
-    headers = {
-        "Token": API_TOKEN,
-        "Content-Type": "application/json"
-    }
+    # 同一会话内重复查询已完成的任务时直接返回缓存结果
+    cached = _TASK_RESULT_CACHE.get(task_uuid)
+    if cached is not None:
+        log.debug("Using cached result for task: %s", task_uuid)
+        return cached
     
-    print(f"Checking status for task: {task_uuid}")
+    log.debug("Checking status for task: %s", task_uuid)
     
-    for retry in range(max_retries):
-        url = TASK_STATUS_API_URL.format(task_uuid=task_uuid)
-        print(f"Request URL: {url}")
-        print(f"Retry {retry+1}/{max_retries}")
+    t0 = time.monotonic()
+    current_delay = initial_delay
+    attempt = 0
+    
+    def wait():
+        # 按指数退避等待，但不超过剩余的总超时时间
+        nonlocal current_delay
+        remaining = total_timeout - (time.monotonic() - t0)
+        if remaining > 0:
+            time.sleep(min(current_delay, remaining))
+        current_delay = min(current_delay * backoff, max_delay)
+    
+    # 任务状态 URL 在轮询过程中不变，只需格式化一次
+    url = _TASK_URL_TMPL.format(task_uuid=task_uuid)
+    log.debug("Request URL: %s", url)
+    
+    first_delay = min(_first_poll_delay(endpoint, eta_hint_ms), total_timeout)
+    if first_delay > 0:
+        log.debug("Waiting %.2f seconds before first poll...", first_delay)
+        time.sleep(first_delay)
+    
+    while time.monotonic() - t0 < total_timeout:
+        attempt += 1
+        log.debug("Attempt %d, elapsed %.2fs", attempt, time.monotonic() - t0)
         
         try:
-            print(f"Sending GET request to {url}")
-            response = requests.get(url, headers=headers)
+            log.debug("Sending GET request to %s", url)
+            remaining = total_timeout - (time.monotonic() - t0)
+            response = _SESSION.get(url, timeout=max(0.1, min(remaining, _POLL_TIMEOUT)))
             
-            print(f"Response status code: {response.status_code}")
-            if response.text:
-                print(f"Response text: {response.text[:500]}...")  # 只打印前500个字符
-            else:
-                print("Response text is empty")
+            log.debug("Response status code: %s", response.status_code)
             
             if response.status_code != 200:
-                print(f"API request failed with status code {response.status_code}")
+                log.warning("API request failed with status code %s", response.status_code)
                 # Continue to retry instead of raising exception immediately
-                time.sleep(retry_interval)
+                wait()
+                continue
+            
+            raw = response.content
+            pending = _PENDING_STATUS_RE.search(raw)
+            if pending:
+                log.debug("Task is %s, waiting %.2f seconds...", pending.group(1).decode("ascii"), current_delay)
+                wait()
                 continue
             
             try:
-                response_data = response.json()
-                print(f"Response data: {json.dumps(response_data)}")
+                response_data = msgspec.json.decode(raw, type=StatusResp)
+                log.debug("Response data: %s", response_data)
                 
-                if response_data.get("code") != 0:
-                    print(f"API request failed: {response_data.get('msg')}")
+                if response_data.code != 0:
+                    log.warning("API request failed: %s", response_data.msg)
                     # Continue to retry instead of raising exception immediately
-                    time.sleep(retry_interval)
+                    wait()
                     continue
                 
                 # 检查响应中是否包含data字段
-                if 'data' not in response_data:
-                    print(f"API response missing 'data' field: {response_data}")
-                    time.sleep(retry_interval)
+                if response_data.data is None:
+                    log.warning("API response missing 'data' field: %s", response_data)
+                    wait()
                     continue
                 
-                data = response_data["data"]
-                status = data.get("status")
+                data = response_data.data
+                status = data.status
                 
-                print(f"Task status: {status}")
+                log.debug("Task status: %s", status)
                 
                 if status == "success":
-                    # 检查响应中是否包含result字段
-                    if 'result' not in data:
-                        print(f"API response missing 'result' field in 'data': {data}")
-                        # 尝试兼容不同的API版本
-                        if 'objects' in data:
-                            print("Found 'objects' directly in data, using it as result")
-                            return {"objects": data.get("objects")}, data.get("session_id")
-                        return {}, data.get("session_id")
-                    
-                    return data.get("result"), data.get("session_id")
+                    task_result = _task_result(data)
+                    _record_latency(endpoint, time.monotonic() - t0)
+                    _TASK_RESULT_CACHE.put(task_uuid, task_result)
+                    return task_result
                 elif status == "failed":
-                    error_msg = data.get("error", "Unknown error")
-                    print(f"Task failed: {error_msg}")
-                    raise Exception(f"Task failed: {error_msg}")
+                    error_msg = data.error if data.error is not None else "Unknown error"
+                    log.error("Task failed: %s", error_msg)
+                    raise TaskFailedError(f"Task failed: {error_msg}")
                 elif status in ["waiting", "running"]:
-                    print(f"Task is {status}, waiting...")
+                    log.debug("Task is %s, waiting...", status)
                 else:
-                    print(f"Unknown task status: {status}")
-            except json.JSONDecodeError:
-                print(f"无法解析JSON响应: {response.text}")
-                time.sleep(retry_interval)
-                continue
+                    log.warning("Unknown task status: %s", status)
+            except msgspec.DecodeError as e:
+                # 已完成的任务响应无法解析或不符合结构时，重试也不会成功，与 _poll_async 一致立即报错
+                log.error("无法解析JSON响应: %s (%s)", response.text, e)
+                raise MalformedResponseError(f"API返回了无效的JSON响应: {e}")
             
-            print(f"Waiting {retry_interval} seconds before next retry...")
-            time.sleep(retry_interval)
+            log.debug("Waiting %.2f seconds before next poll...", current_delay)
+            wait()
+        except (TaskFailedError, MalformedResponseError):
+            raise
         except Exception as e:
-            print(f"Error checking task status: {str(e)}")
-            import traceback
-            print(traceback.format_exc())
-            time.sleep(retry_interval)
+            log.warning("Error checking task status: %s", e, exc_info=log.isEnabledFor(logging.DEBUG))
+            wait()
     
-    raise Exception(f"Task timed out after {max_retries * retry_interval} seconds")
+    raise TaskTimeoutError(f"Task timed out after {time.monotonic() - t0:.1f} seconds")
 
 def detect_objects(image, prompt_type="text", prompt_text=None, prompt_universal=None, 
-                  targets=["bbox"], bbox_threshold=0.25, iou_threshold=0.8, session_id=None):
+                  targets=["bbox"], bbox_threshold=0.25, iou_threshold=0.8, session_id=None, use_cache=True):
     """
     Detect objects in an image using the DINO-X API
+    相同图像和参数的结果会被缓存；带 session_id 的请求是有状态的，不使用缓存
+    需要真实访问 API 时（如验证令牌、测试连接）传入 use_cache=False
     """
     try:
-        print(f"\n===== DINO-X API 调用开始 =====")
-        print(f"提示类型: {prompt_type}")
+        cache_key = None
+        digest = None
+        if use_cache and not session_id:
+            # 图像只哈希一次，同时用于结果缓存和编码缓存
+            digest = _image_digest(image)
+            cache_key = _result_cache_key("detection", digest, {
+                "prompt_type": prompt_type,
+                "prompt_text": prompt_text,
+                "prompt_universal": prompt_universal,
+                "targets": targets,
+                "bbox_threshold": bbox_threshold,
+                "iou_threshold": iou_threshold
+            })
+            cached = _result_cache_get(cache_key)
+            if cached is not None:
+                log.debug("Using cached detection result")
+                return cached
+        
+        log.debug("===== DINO-X API 调用开始 =====")
+        log.debug("提示类型: %s", prompt_type)
         if prompt_type == "text":
-            print(f"提示文本: {prompt_text}")
+            log.debug("提示文本: %s", prompt_text)
         else:
-            print(f"通用提示值: {prompt_universal}")
-        print(f"检测目标: {targets}")
-        print(f"置信度阈值: {bbox_threshold}")
-        print(f"IoU 阈值: {iou_threshold}")
-        print(f"会话 ID: {session_id}")
-        print(f"API URL: {DETECTION_API_URL}")
+            log.debug("通用提示值: %s", prompt_universal)
+        log.debug("检测目标: %s", targets)
+        log.debug("置信度阈值: %s", bbox_threshold)
+        log.debug("IoU 阈值: %s", iou_threshold)
+        log.debug("会话 ID: %s", session_id)
+        log.debug("API URL: %s", DETECTION_API_URL)
         
         # 检查 API 令牌
         if not API_TOKEN or API_TOKEN == "你的API令牌":
-            print("警告: API 令牌未设置或使用了默认值")
-        else:
-            print(f"API 令牌: {API_TOKEN[:5]}...{API_TOKEN[-5:]} (已设置)")
+            log.warning("API 令牌未设置或使用了默认值")
         
         # 创建检测任务
-        task_uuid = detect_objects_async(
+        task_uuid, eta_hint_ms = detect_objects_async(
             image, prompt_type, prompt_text, prompt_universal, 
-            targets, bbox_threshold, iou_threshold, session_id
+            targets, bbox_threshold, iou_threshold, session_id, digest=digest
         )
         
-        print(f"任务 UUID: {task_uuid}")
+        log.debug("任务 UUID: %s", task_uuid)
         
-        # 获取任务结果
-        result, new_session_id = get_task_result(task_uuid)
+        # 获取任务结果，并将坐标映射回原始分辨率
+        result, new_session_id = get_task_result(task_uuid, eta_hint_ms=eta_hint_ms, endpoint="detection")
+        result = _rescale_result(result, _upload_scale(image))
         
-        print(f"检测完成, 会话 ID: {new_session_id}")
+        log.info("检测完成, 会话 ID: %s", new_session_id)
         
-        # 打印完整的API响应，包括所有字段
-        print("API响应完整数据:")
-        if "objects" in result:
-            for i, obj in enumerate(result["objects"]):
-                print(f"\n对象 {i+1}:")
-                for key, value in obj.items():
-                    if key == "mask":
-                        print(f"  {key}: {type(value)} - {value.keys() if isinstance(value, dict) else '非字典类型'}")
-                    elif key in ["pose_keypoints", "hand_keypoints"]:
-                        print(f"  {key}: {type(value)} - 长度: {len(value) if isinstance(value, list) else '非列表类型'}")
-                    else:
-                        print(f"  {key}: {value}")
-        
-        print(f"===== DINO-X API 调用结束 =====\n")
+        # 打印完整的API响应，包括所有字段（仅在 DEBUG 级别下执行，避免无谓的格式化开销）
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("API响应完整数据:")
+            if "objects" in result:
+                for i, obj in enumerate(result["objects"]):
+                    log.debug("对象 %d:", i + 1)
+                    for key, value in obj.items():
+                        if key == "mask":
+                            log.debug("  %s: %s - %s", key, type(value), value.keys() if isinstance(value, dict) else '非字典类型')
+                        elif key in ["pose_keypoints", "hand_keypoints"]:
+                            log.debug("  %s: %s - 长度: %s", key, type(value), len(value) if isinstance(value, list) else '非列表类型')
+                        else:
+                            log.debug("  %s: %s", key, value)
+            
+            log.debug("===== DINO-X API 调用结束 =====")
         
+        _result_cache_put(cache_key, (result, new_session_id))
         return result, new_session_id
     
     except Exception as e:
-        print(f"检测过程中出错: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
+        log.exception("检测过程中出错")
         # Return empty result but don't raise exception to avoid breaking the UI
-        return {"objects": []}, session_id
+        # error 字段说明失败原因（auth/timeout/malformed/...），便于调用方区分处理
+        return {"objects": [], "error": _error_info(e)}, session_id
 
 def create_region_vl_task(image, regions, targets=["caption"], prompt_type=None, 
-                         prompt_text=None, prompt_universal=None, session_id=None):
+                         prompt_text=None, prompt_universal=None, session_id=None, digest=None):
     """
-    Create a region visual language task using the DINO-X API
-    按照最新API文档创建区域视觉语言任务
+    Create a region visual language task using the DINO-X API and return (task_uuid, eta_hint_ms)
+    按照最新API文档创建区域视觉语言任务；digest 为已计算好的图像哈希，用于复用编码缓存
     """
     if not API_TOKEN:
-        raise ValueError("API token not found. Please set the DINOX_API_TOKEN environment variable.")
+        raise AuthError("API token not found. Please set the DINOX_API_TOKEN environment variable.")
+    
+    _start_warmup()
     
     # 准备图像数据
-    image_data = image if isinstance(image, str) else encode_image_to_base64(image)
+    image_data = _to_data_url(image, digest)
+    # 图像被缩小时，区域坐标也需要按相同比例缩放
+    scale = _upload_scale(image)
+    if scale != 1.0:
+        regions = [[v * scale for v in region] for region in regions]
     
     # 准备请求载荷
     payload = {
@@ -329,80 +877,359 @@ def create_region_vl_task(image, regions, targets=["caption"], prompt_type=None,
     if session_id:
         payload["session_id"] = session_id
     
-    # 准备请求头
-    headers = {
-        "Token": API_TOKEN,
-        "Content-Type": "application/json"
-    }
-    
-    print(f"Sending request to {REGION_VL_API_URL}")
-    print(f"Headers: {headers}")
-    print(f"Payload: {json.dumps({k: v if k != 'image' else '...' for k, v in payload.items()})}")
+    log.debug("Sending request to %s", REGION_VL_API_URL)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Payload: %s", orjson.dumps({k: v if k != 'image' else '...' for k, v in payload.items()}, option=_JSON_OPTIONS).decode())
     
-    # 发送API请求 - 尝试两种方式
+    # 发送API请求，限流或服务端暂时不可用时退避重试
     try:
-        # 方式1: 使用json参数（requests会自动处理JSON序列化）
-        response = requests.post(REGION_VL_API_URL, json=payload, headers=headers)
-        
-        print(f"Response status code: {response.status_code}")
-        print(f"Response text: {response.text}")
-        
-        if response.status_code != 200:
-            print("尝试替代方法...")
-            # 方式2: 手动序列化JSON并使用data参数
-            json_payload = json.dumps(payload)
-            response = requests.post(REGION_VL_API_URL, data=json_payload, headers=headers)
-            
-            print(f"Alternative method response status code: {response.status_code}")
-            print(f"Alternative method response text: {response.text}")
+        body = orjson.dumps(payload, option=_JSON_OPTIONS)
+        response = _post_task(REGION_VL_API_URL, body)
     except Exception as e:
-        print(f"API request error: {str(e)}")
+        log.error("API request error: %s", e)
         raise
     
+    # 只在出错时才把响应体解码为文本
     if response.status_code != 200:
-        raise Exception(f"API request failed with status code {response.status_code}: {response.text}")
-    
-    response_data = response.json()
-    print(f"Response data: {json.dumps(response_data)}")
-    
-    if response_data.get("code") != 0:
-        raise Exception(f"API request failed: {response_data.get('msg')}")
+        _check_http_status(response.status_code, response.text)
     
-    # 检查响应中是否包含task_uuid
-    if 'data' not in response_data:
-        raise Exception(f"API response missing 'data' field: {response_data}")
-    
-    # 检查是否包含task_uuid或uuid（兼容不同的API版本）
-    if 'task_uuid' in response_data['data']:
-        return response_data["data"]["task_uuid"]
-    elif 'uuid' in response_data['data']:
-        return response_data["data"]["uuid"]
-    else:
-        raise Exception(f"API response missing task identifier in 'data': {response_data['data']}")
+    return _parse_submit_response(response.content)
 
 def get_region_descriptions(image, regions, targets=["caption"], prompt_type=None, 
-                           prompt_text=None, prompt_universal=None, session_id=None):
+                           prompt_text=None, prompt_universal=None, session_id=None, use_cache=True):
     """
     Get descriptions for regions in an image using the DINO-X API
+    相同图像和参数的结果会被缓存；带 session_id 的请求是有状态的，不使用缓存
+    需要真实访问 API 时传入 use_cache=False
     """
     try:
-        print(f"Starting region descriptions with targets={targets}, regions count={len(regions)}")
+        cache_key = None
+        digest = None
+        if use_cache and not session_id:
+            # 图像只哈希一次，同时用于结果缓存和编码缓存
+            digest = _image_digest(image)
+            cache_key = _result_cache_key("region_vl", digest, {
+                "regions": regions,
+                "targets": targets,
+                "prompt_type": prompt_type,
+                "prompt_text": prompt_text,
+                "prompt_universal": prompt_universal
+            })
+            cached = _result_cache_get(cache_key)
+            if cached is not None:
+                log.debug("Using cached region descriptions")
+                return cached
+        
+        log.debug("Starting region descriptions with targets=%s, regions count=%d", targets, len(regions))
         
         # Create region VL task
-        task_uuid = create_region_vl_task(
-            image, regions, targets, prompt_type, prompt_text, prompt_universal, session_id
+        task_uuid, eta_hint_ms = create_region_vl_task(
+            image, regions, targets, prompt_type, prompt_text, prompt_universal, session_id, digest=digest
         )
         
-        print(f"Region VL task created with UUID: {task_uuid}")
+        log.debug("Region VL task created with UUID: %s", task_uuid)
         
         # Get task status
-        result, new_session_id = get_task_result(task_uuid)
+        result, new_session_id = get_task_result(task_uuid, eta_hint_ms=eta_hint_ms, endpoint="region_vl")
+        result = _rescale_result(result, _upload_scale(image))
         
-        print(f"Region descriptions completed, session_id: {new_session_id}")
+        log.info("Region descriptions completed, session_id: %s", new_session_id)
         
+        _result_cache_put(cache_key, (result, new_session_id))
         return result, new_session_id
     
     except Exception as e:
-        print(f"Error in get_region_descriptions: {str(e)}")
+        log.error("Error in get_region_descriptions: %s", e)
         # Return empty result but don't raise exception to avoid breaking the UI
-        return {"objects": []}, session_id 
\ No newline at end of file
+        return {"objects": [], "error": _error_info(e)}, session_id 
+
+def _regions_from_bboxes(result):
+    """
+    Default region extractor for detect_then_describe: the bbox of every detected object
+    """
+    return [obj["bbox"] for obj in result.get("objects", []) if obj.get("bbox")]
+
+def detect_then_describe(image, regions_from_result=None, prompt_type="text", prompt_text=None,
+                         prompt_universal=None, targets=["bbox"], bbox_threshold=0.25, iou_threshold=0.8,
+                         region_targets=["caption"], session_id=None):
+    """
+    Detect objects and then describe the detected regions, encoding the image only once
+    检测完成后立即用同一份编码数据提交区域描述任务，避免重复编码和上传准备
+    regions_from_result 从检测结果中提取区域列表，默认使用所有对象的 bbox
+
+    Returns (detection_result, region_result, session_id)
+    """
+    regions_from_result = regions_from_result or _regions_from_bboxes
+    scale = _upload_scale(image)
+    try:
+        _start_warmup()
+        image_data = _to_data_url(image)
+        
+        task_uuid, eta_hint_ms = detect_objects_async(
+            image_data, prompt_type, prompt_text, prompt_universal,
+            targets, bbox_threshold, iou_threshold, session_id
+        )
+        detection_result, session_id = get_task_result(task_uuid, eta_hint_ms=eta_hint_ms, endpoint="detection")
+        
+        # 检测结果的坐标基于上传的（可能已缩小的）图像，可直接作为区域提交
+        regions = regions_from_result(detection_result)
+        region_result = {"objects": []}
+        if regions:
+            task_uuid, eta_hint_ms = create_region_vl_task(
+                image_data, regions, region_targets, prompt_type, prompt_text, prompt_universal, session_id
+            )
+            region_result, session_id = get_task_result(task_uuid, eta_hint_ms=eta_hint_ms, endpoint="region_vl")
+        
+        return _rescale_result(detection_result, scale), _rescale_result(region_result, scale), session_id
+    
+    except Exception as e:
+        log.exception("检测与区域描述过程中出错")
+        # Return empty result but don't raise exception to avoid breaking the UI
+        error = _error_info(e)
+        return {"objects": [], "error": error}, {"objects": [], "error": error}, session_id
+
+async def _poll_async(session, task_uuid, total_timeout=60, initial_delay=0.2, max_delay=3.0, backoff=1.5,
+                      eta_hint_ms=None, endpoint=None):
+    """
+    Asynchronously poll a task until it reaches a terminal state
+    与 get_task_result 使用相同的指数退避策略，但通过 asyncio.sleep 等待，不阻塞事件循环
+    """
+    url = _TASK_URL_TMPL.format(task_uuid=task_uuid)
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    current_delay = initial_delay
+    
+    first_delay = min(_first_poll_delay(endpoint, eta_hint_ms), total_timeout)
+    if first_delay > 0:
+        await asyncio.sleep(first_delay)
+    
+    while loop.time() - t0 < total_timeout:
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    raw = await response.read()
+                    # 未完成的任务只做字节检查，跳过完整解析
+                    data = None
+                    if not _PENDING_STATUS_RE.search(raw):
+                        try:
+                            response_data = msgspec.json.decode(raw, type=StatusResp)
+                        except msgspec.DecodeError as e:
+                            raise MalformedResponseError(f"API返回了无效的JSON响应: {e}")
+                        data = response_data.data if response_data.code == 0 else None
+                    if data is not None:
+                        if data.status == "success":
+                            _record_latency(endpoint, loop.time() - t0)
+                            return _task_result(data)
+                        elif data.status == "failed":
+                            error_msg = data.error if data.error is not None else "Unknown error"
+                            raise TaskFailedError(f"Task failed: {error_msg}")
+                else:
+                    log.warning("Task %s: status request failed with status code %s", task_uuid, response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # 连接被复用时服务端可能已断开，与 get_task_result 一样退避后重试
+            log.warning("Task %s: error checking task status: %s", task_uuid, e)
+        
+        remaining = total_timeout - (loop.time() - t0)
+        if remaining > 0:
+            await asyncio.sleep(min(current_delay, remaining))
+        current_delay = min(current_delay * backoff, max_delay)
+    
+    raise TaskTimeoutError(f"Task timed out after {loop.time() - t0:.1f} seconds")
+
+def _encode_in_executor(loop, process_pool, image, image_format=None, quality=None):
+    """
+    Schedule conversion of an image input to a data URL off the event loop
+    """
+    if _is_pixel_image(image):
+        # 图像编码是 CPU 密集型操作，放到进程池中执行，与网络 I/O 重叠
+        return loop.run_in_executor(process_pool, _encode_image, image, image_format, quality)
+    # bytes / Path 可能需要读文件，放到线程池中避免阻塞事件循环
+    return loop.run_in_executor(None, _to_data_url, image)
+
+async def _submit_async(session, payload, limiter=None, max_retries=3, base_delay=0.5, max_delay=8.0, jitter=0.5):
+    """
+    Submit a detection task, retrying 429/5xx responses with jittered exponential backoff
+    limiter 为可选的 AsyncLimiter，每次发送（包括重试）前先获取一个令牌
+    """
+    body = orjson.dumps(payload, option=_JSON_OPTIONS)
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            await limiter.acquire()
+        async with session.post(DETECTION_API_URL, data=body) as response:
+            if response.status in _RETRY_STATUSES and attempt < max_retries:
+                delay = min(max_delay, base_delay * 2 ** attempt) + random.uniform(0, jitter)
+                log.warning("Submit got status %s, retrying in %.2f seconds", response.status, delay)
+            else:
+                if response.status != 200:
+                    _check_http_status(response.status, await response.text())
+                return _parse_submit_response(await response.read())
+        await asyncio.sleep(delay)
+
+async def detect_objects_async_io(images, concurrency=10, quality=None, image_format=None,
+                                  encode_workers=None, **kwargs):
+    """
+    Detect objects in many images concurrently using asyncio + aiohttp
+    使用信号量构成滑动窗口：任一请求完成后立即释放名额给下一张图像，
+    同时在途的请求数不超过 concurrency（DINO-X 建议最多 10 个并发）
+
+    图像编码在 encode_workers 个进程中并行完成（默认为 CPU 核心数）
+    生产者提前编码后续图像，每张图像的提交和轮询作为独立任务并发执行，使编码/上传与服务端推理重叠
+    kwargs 与 detect_objects 的检测参数相同；返回与 images 顺序一致的 (result, session_id) 列表
+    """
+    if not API_TOKEN or API_TOKEN == "你的API令牌":
+        raise AuthError("API token not found or using default value. Please set the DINOX_API_TOKEN environment variable.")
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    images = list(images)
+    results = [None] * len(images)
+    
+    def fail(index, e):
+        log.error("图像 %d 检测出错: %s", index, e)
+        # 与 detect_objects 保持一致：单张图像失败时返回空结果
+        results[index] = {"objects": [], "error": _error_info(e)}, kwargs.get("session_id")
+    
+    def encode(process_pool, image):
+        return _encode_in_executor(loop, process_pool, image, image_format, quality)
+    
+    async def detect(session, index, image, image_data):
+        # 提交和轮询在各自的任务中进行，多个图像的上传可以同时在途
+        try:
+            payload = _build_detection_payload(image_data, **kwargs)
+            task_uuid, eta_hint_ms = await _submit_async(session, payload)
+            result, new_session_id = await _poll_async(
+                session, task_uuid, eta_hint_ms=eta_hint_ms, endpoint="detection"
+            )
+            results[index] = _rescale_result(result, _upload_scale(image)), new_session_id
+        except Exception as e:
+            fail(index, e)
+        finally:
+            semaphore.release()
+    
+    async def produce(session, process_pool):
+        # 编码窗口比提交领先 concurrency 张图像
+        pending = deque()
+        upcoming = iter(enumerate(images))
+        running = []
+        
+        def schedule_next():
+            item = next(upcoming, None)
+            if item is not None:
+                index, image = item
+                pending.append((index, image, encode(process_pool, image)))
+        
+        for _ in range(concurrency):
+            schedule_next()
+        
+        try:
+            while pending:
+                index, image, encoding = pending.popleft()
+                schedule_next()
+                try:
+                    image_data = await encoding
+                except Exception as e:
+                    fail(index, e)
+                    continue
+                
+                # 名额在该图像轮询结束后释放，保证在途任务数不超过 concurrency
+                await semaphore.acquire()
+                running.append(asyncio.ensure_future(detect(session, index, image, image_data)))
+            
+            await asyncio.gather(*running)
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+    
+    process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=encode_workers)
+    try:
+        async with aiohttp.ClientSession(headers=_HEADERS) as session:
+            await produce(session, process_pool)
+    finally:
+        # 不等待编码进程退出，避免取消或出错时阻塞事件循环
+        process_pool.shutdown(wait=False)
+    return results
+
+def detect_objects_batch(images, concurrency=10, quality=None, image_format=None, encode_workers=None, **kwargs):
+    """
+    Synchronous wrapper around detect_objects_async_io
+    """
+    return asyncio.run(detect_objects_async_io(
+        images, concurrency=concurrency, quality=quality, image_format=image_format,
+        encode_workers=encode_workers, **kwargs
+    ))
+
+async def detect_objects_many(images, *, concurrency=10, rate_per_sec=20, total_timeout=None, item_timeout=120,
+                              quality=None, image_format=None, encode_workers=None, **kwargs):
+    """
+    Detect objects in a list or generator of images, yielding (index, (result, session_id)) as each finishes
+    - 同时在途的任务不超过 concurrency（DINO-X 建议最多 10 个并发）
+    - 提交请求经过令牌桶限速（每秒 rate_per_sec 个），429/5xx 会带抖动地指数退避重试
+    - 结果按完成顺序产出，慢任务不会阻塞其他结果
+    - item_timeout 限制单张图像的处理时间，total_timeout 限制整个批次的时间（None 表示不限）
+
+    kwargs 与 detect_objects 的检测参数相同；失败的图像产出带 error 字段的空结果
+    """
+    if not API_TOKEN or API_TOKEN == "你的API令牌":
+        raise AuthError("API token not found or using default value. Please set the DINOX_API_TOKEN environment variable.")
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = AsyncLimiter(rate_per_sec, 1)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + total_timeout if total_timeout else None
+    
+    async def process(session, process_pool, image, timeout):
+        image_data = await _encode_in_executor(loop, process_pool, image, image_format, quality)
+        payload = _build_detection_payload(image_data, **kwargs)
+        task_uuid, eta_hint_ms = await _submit_async(session, payload, limiter)
+        result, new_session_id = await _poll_async(
+            session, task_uuid, total_timeout=timeout, eta_hint_ms=eta_hint_ms, endpoint="detection"
+        )
+        return _rescale_result(result, _upload_scale(image)), new_session_id
+    
+    async def detect_one(session, process_pool, index, image):
+        try:
+            async with semaphore:
+                timeout = item_timeout
+                if deadline is not None:
+                    timeout = min(timeout, deadline - loop.time())
+                if timeout <= 0:
+                    raise TaskTimeoutError("Batch timed out before the image was submitted")
+                try:
+                    return index, await asyncio.wait_for(process(session, process_pool, image, timeout), timeout)
+                except asyncio.TimeoutError:
+                    raise TaskTimeoutError(f"Image timed out after {timeout:.1f} seconds")
+        except Exception as e:
+            log.error("图像 %d 检测出错: %s", index, e)
+            return index, ({"objects": [], "error": _error_info(e)}, kwargs.get("session_id"))
+    
+    process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=encode_workers)
+    try:
+        async with aiohttp.ClientSession(headers=_HEADERS) as session:
+            # 按需从输入中取图像，最多保留 2 * concurrency 个待处理任务，支持任意长的生成器
+            upcoming = enumerate(images)
+            running = set()
+            
+            def fill():
+                while len(running) < 2 * concurrency:
+                    item = next(upcoming, None)
+                    if item is None:
+                        return
+                    running.add(asyncio.ensure_future(detect_one(session, process_pool, *item)))
+            
+            try:
+                fill()
+                while running:
+                    done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    running.difference_update(done)
+                    fill()
+                    for task in done:
+                        yield task.result()
+            finally:
+                # 调用方提前停止迭代时取消剩余任务，并等待它们结束后再关闭会话
+                for task in running:
+                    task.cancel()
+                await asyncio.gather(*running, return_exceptions=True)
+    finally:
+        # 不等待编码进程退出，避免阻塞事件循环
+        process_pool.shutdown(wait=False)